@@ -20,6 +20,7 @@ from __future__ import annotations
 
 import io
 import json
+import os
 import re
 import time
 import datetime
@@ -42,6 +43,10 @@ _DOWNLOAD_HREF_RE = re.compile(
     r"""href=['"]([^'"]*FileDownload\.ashx[^'"]+)['"]""",
     re.IGNORECASE,
 )
+_DOWNLOAD_ASHX_RE = re.compile(
+    r"""['"]([^'"]*edoc2/FileDownload\.ashx\?[^'"]+)['"]""",
+    re.IGNORECASE,
+)
 
 HEADERS = {
     "User-Agent": (
@@ -60,6 +65,7 @@ CONVERSION_PRICE_PATTERNS = [
     re.compile(r"轉換價格\s+([\d,]+(?:\.\d+)?)"),
     re.compile(r"轉換價[：:]\s*([\d,]+(?:\.\d+)?)\s*元?"),
 ]
+_MONEY_RE = re.compile(r"([\d,]+(?:\.\d+)?)\s*元")
 
 # 轉換價格的合理範圍（每股台幣），排除面額 100,000 等非股價數字
 _PRICE_MIN = 1.0
@@ -130,6 +136,16 @@ class _FormParser(HTMLParser):
             self._current_cell += data
 
 
+def _write_atomic(path: Path, data: bytes) -> None:
+    """Write via a sibling temp file so a killed run never leaves a partial file."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
 def _parse_page(html: str) -> tuple[dict[str, str], list[dict]]:
     parser = _FormParser()
     parser.feed(html)
@@ -159,14 +175,13 @@ def _extract_conversion_price(pdf_bytes: bytes) -> str | None:
     # Pass 2: find every occurrence of 轉換價格, then look up to 500 chars
     # after it for a number followed by 元.
     # This handles table layouts where header and value are separated.
-    money_re = re.compile(r"([\d,]+(?:\.\d+)?)\s*元")
     search_start = 0
     while True:
         idx = text.find("轉換價格", search_start)
         if idx < 0:
             break
         window = text[idx: idx + 500]
-        m = money_re.search(window)
+        m = _MONEY_RE.search(window)
         if m:
             price_str = m.group(1).replace(",", "")
             if _valid(price_str):
@@ -188,7 +203,7 @@ def _resolve_download_url(html: str) -> str | None:
                 return url
             return BASE_URL + url
     # Also look for raw FileDownload.ashx occurrence with query string
-    m = re.search(r"""['"]([^'"]*edoc2/FileDownload\.ashx\?[^'"]+)['"]""", html, re.IGNORECASE)
+    m = _DOWNLOAD_ASHX_RE.search(html)
     if m:
         url = m.group(1)
         if url.startswith("/"):
@@ -344,9 +359,9 @@ def main() -> int:
     kept = [e for e in existing if not e.get("bid_start", "").startswith(year_prefix)]
     merged = kept + new_entries
 
-    OUTPUT_PATH.write_text(
-        json.dumps(merged, ensure_ascii=False, indent=2) + "\n",
-        encoding="utf-8",
+    _write_atomic(
+        OUTPUT_PATH,
+        (json.dumps(merged, ensure_ascii=False, indent=2) + "\n").encode("utf-8"),
     )
     with_price = sum(1 for e in merged if e.get("conversion_price"))
     print(f"\n完成：{len(merged)} 筆資料（{with_price} 筆有轉換價），存至 {OUTPUT_PATH}")
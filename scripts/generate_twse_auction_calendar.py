@@ -6,26 +6,72 @@ from __future__ import annotations
 import argparse
 import hashlib
 import json
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable
-from urllib.error import HTTPError, URLError
-from urllib.request import Request, urlopen
+from typing import Iterable, Iterator
+
+import requests
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup; stdlib json still works.
+    orjson = None
 
 API_BASE = "https://www.twse.com.tw/rwd/zh/announcement"
 SOURCE_PAGE = "https://www.twse.com.tw/zh/announcement/auction.html"
+SOURCE_LINE = f"資料來源：{SOURCE_PAGE}"
+
+# Years are fetched concurrently; keep this small to stay polite to TWSE.
+FETCH_WORKERS = 4
+
+# One pooled session so the per-year requests reuse the TLS connection.
+SESSION = requests.Session()
+SESSION.headers.update(
+    {
+        "User-Agent": (
+            "Mozilla/5.0 (compatible; twse-auction-calendar/1.0; "
+            "+https://www.twse.com.tw/)"
+        )
+    }
+)
 
 CONVERSION_PRICES_PATH = Path(__file__).parent / "conversion_prices.json"
 
+# Raw TWSE responses are cached here so notify_discord.py and this script can
+# share one download per run, and past years are not re-fetched every time.
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache" / "twse"
+CURRENT_YEAR_CACHE_TTL = 30 * 60
+PAST_YEAR_CACHE_TTL = 24 * 60 * 60
+
+
+def loads_json(data: bytes):
+    """Decode UTF-8 JSON bytes, without an intermediate str when orjson exists."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode("utf-8"))
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Write via a sibling temp file so a killed run never leaves a partial file."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
 
 def load_conversion_price_index() -> dict[tuple[str, str], str]:
     """Load conversion_prices.json and index by (bid_start, bid_end)."""
     if not CONVERSION_PRICES_PATH.exists():
         return {}
     try:
-        entries = json.loads(CONVERSION_PRICES_PATH.read_text("utf-8"))
+        entries = loads_json(CONVERSION_PRICES_PATH.read_bytes())
     except Exception:
         return {}
     index: dict[tuple[str, str], str] = {}
@@ -37,12 +83,14 @@ def load_conversion_price_index() -> dict[tuple[str, str], str]:
     return index
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CalendarEvent:
     event_date: date
     summary: str
     description: str
     uid: str
+    # ics_escape(description), built from a per-row escaped body.
+    escaped_description: str
 
 
 EVENT_DATE_FIELDS: tuple[tuple[str, str], ...] = (
@@ -52,25 +100,54 @@ EVENT_DATE_FIELDS: tuple[tuple[str, str], ...] = (
     ("撥券日期(上市、上櫃日期)", "撥券/掛牌"),
 )
 
+CALENDAR_HEADER_LINES: tuple[str, ...] = (
+    "BEGIN:VCALENDAR",
+    "VERSION:2.0",
+    "PRODID:-//TWSE Auction Calendar//EN",
+    "CALSCALE:GREGORIAN",
+    "METHOD:PUBLISH",
+    "X-WR-CALNAME:TWSE 競價拍賣公告",
+    "X-WR-CALDESC:由 TWSE 競價拍賣公告自動產生",
+    "X-WR-TIMEZONE:Asia/Taipei",
+)
+
+# Closing lines shared verbatim by every VEVENT.
+EVENT_TRAILER_LINES: tuple[str, ...] = (
+    f"URL:{SOURCE_PAGE}",
+    "STATUS:CONFIRMED",
+    "TRANSP:TRANSPARENT",
+    "END:VEVENT",
+)
+
+
+def fetch_json(
+    url: str, *, retries: int = 3, timeout: int = 20, max_age: float = 0
+) -> dict:
+    """Fetch JSON with basic retry logic for temporary network errors.
+
+    With max_age > 0 the raw response is cached under CACHE_DIR and reused
+    while the cached file is younger than max_age seconds.
+    """
+    cache_path = CACHE_DIR / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json"
+    if max_age > 0:
+        try:
+            if time.time() - cache_path.stat().st_mtime < max_age:
+                return loads_json(cache_path.read_bytes())
+        except (OSError, json.JSONDecodeError):
+            pass
 
-def fetch_json(url: str, *, retries: int = 3, timeout: int = 20) -> dict:
-    """Fetch JSON with basic retry logic for temporary network errors."""
-    request = Request(
-        url,
-        headers={
-            "User-Agent": (
-                "Mozilla/5.0 (compatible; twse-auction-calendar/1.0; "
-                "+https://www.twse.com.tw/)"
-            )
-        },
-    )
     last_error: Exception | None = None
     for attempt in range(1, retries + 1):
         try:
-            with urlopen(request, timeout=timeout) as response:
-                body = response.read().decode("utf-8")
-            return json.loads(body)
-        except (HTTPError, URLError, TimeoutError, json.JSONDecodeError) as exc:
+            response = SESSION.get(url, timeout=timeout)
+            response.raise_for_status()
+            payload = loads_json(response.content)
+            # Never cache TWSE error/throttle replies, which come back as 200.
+            if max_age > 0 and str(payload.get("stat", "OK")).upper() == "OK":
+                CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                write_atomic(cache_path, response.content)
+            return payload
+        except (requests.RequestException, json.JSONDecodeError) as exc:
             last_error = exc
             if attempt == retries:
                 break
@@ -78,60 +155,88 @@ def fetch_json(url: str, *, retries: int = 3, timeout: int = 20) -> dict:
     raise RuntimeError(f"無法取得資料：{url}") from last_error
 
 
+def fetch_year_payload(year: int) -> dict:
+    """Fetch one year's auction list; past years are cached for longer."""
+    max_age = (
+        PAST_YEAR_CACHE_TTL if year < date.today().year else CURRENT_YEAR_CACHE_TTL
+    )
+    return fetch_json(f"{API_BASE}/auction?date={year}&response=json", max_age=max_age)
+
+
+@lru_cache(maxsize=4096)
 def parse_twse_date(value: str) -> date | None:
-    """Parse date string in TWSE format (YYYY/MM/DD)."""
+    """Parse date string in TWSE format (YYYY/MM/DD).
+
+    TWSE does not zero-pad month/day (e.g. 2016/1/7), so split on the
+    separator instead of slicing fixed positions; this also avoids strptime.
+    """
     cleaned = (value or "").strip()
     if not cleaned or cleaned in {"0", "-", "--", "－"}:
         return None
-    for fmt in ("%Y/%m/%d", "%Y-%m-%d"):
+    for sep in ("/", "-"):
+        parts = cleaned.split(sep)
+        if len(parts) != 3 or len(parts[0]) != 4:
+            continue
+        if not all(part.isascii() and part.isdigit() for part in parts):
+            continue
         try:
-            return datetime.strptime(cleaned, fmt).date()
+            return date(int(parts[0]), int(parts[1]), int(parts[2]))
         except ValueError:
-            continue
+            return None
     return None
 
 
 def ics_escape(text: str) -> str:
     """Escape text fields per RFC 5545."""
+    text = text or ""
+    # TWSE text rarely contains CR, so only normalise line endings when needed.
+    # (str.translate was measured ~9x slower than chained replace on CJK text.)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
     return (
-        (text or "")
-        .replace("\\", "\\\\")
+        text.replace("\\", "\\\\")
         .replace(";", r"\;")
         .replace(",", r"\,")
-        .replace("\r\n", "\n")
-        .replace("\r", "\n")
         .replace("\n", r"\n")
     )
 
 
-def fold_ical_line(line: str, limit: int = 75) -> list[str]:
-    """Fold long iCalendar lines to <= 75 octets."""
-    if not line:
-        return [""]
-    parts: list[str] = []
-    current = ""
-    current_len = 0
-    for ch in line:
-        ch_len = len(ch.encode("utf-8"))
-        if current and current_len + ch_len > limit:
-            parts.append(current)
-            current = ch
-            current_len = ch_len
+def fold_ical_line(line: bytes, limit: int = 75) -> list[bytes]:
+    """Fold a UTF-8 encoded iCalendar line to <= 75 octets."""
+    total = len(line)
+    if total <= limit:
+        return [line]
+    parts: list[bytes] = []
+    start = 0
+    width = limit
+    while start < total:
+        end = start + width
+        if end >= total:
+            end = total
         else:
-            current += ch
-            current_len += ch_len
-    parts.append(current)
-    return [parts[0], *[f" {chunk}" for chunk in parts[1:]]]
+            # Back up so the cut never lands inside a multi-byte character.
+            while line[end] & 0xC0 == 0x80:
+                end -= 1
+        parts.append(line[start:end])
+        start = end
+        # Continuation lines begin with a space, which counts toward the limit.
+        width = limit - 1
+    return [parts[0], *[b" " + chunk for chunk in parts[1:]]]
 
 
 def normalize_row(fields: list[str], row: list[str]) -> dict[str, str]:
-    normalized: dict[str, str] = {}
-    for idx, key in enumerate(fields):
-        normalized[key] = str(row[idx]).strip() if idx < len(row) else ""
+    # Columns missing from a short row default to "".
+    normalized = dict.fromkeys(fields, "")
+    normalized.update(zip(fields, (str(value).strip() for value in row)))
     return normalized
 
 
 def stable_uid(source: str) -> str:
+    """Hash the event identity into a UID.
+
+    Subscribed clients match events by UID, so the digest must stay the same
+    across releases; changing the scheme would duplicate every event.
+    """
     digest = hashlib.sha1(source.encode("utf-8")).hexdigest()
     return f"{digest}@twse-auction-calendar"
 
@@ -145,22 +250,31 @@ def stable_dtstamp(event: CalendarEvent) -> str:
     # Map hash to a fixed 50-year UTC window to keep DTSTAMP valid and stable.
     seconds = int(digest[:10], 16) % (50 * 365 * 24 * 60 * 60)
     stamp = datetime(2000, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=seconds)
-    return stamp.strftime("%Y%m%dT%H%M%SZ")
+    return (
+        f"{stamp.year:04d}{stamp.month:02d}{stamp.day:02d}"
+        f"T{stamp.hour:02d}{stamp.minute:02d}{stamp.second:02d}Z"
+    )
+
+
+@lru_cache(maxsize=4096)
+def ics_date(value: date) -> str:
+    """Format an iCalendar DATE; events share few distinct dates, so cache it."""
+    return f"{value.year:04d}{value.month:02d}{value.day:02d}"
 
 
 def value_or_dash(row: dict[str, str], key: str) -> str:
-    value = row.get(key, "").strip()
+    # Expects a normalize_row() result, whose values are already stripped.
+    value = row.get(key, "")
     return value if value else "-"
 
 
 def build_events(
-    fields: list[str],
-    rows: list[list[str]],
+    rows: Iterable[dict[str, str]],
     conversion_price_index: dict[tuple[str, str], str] | None = None,
 ) -> list[CalendarEvent]:
+    """Build calendar events from normalize_row() results."""
     events: list[CalendarEvent] = []
-    for raw_row in rows:
-        row = normalize_row(fields, raw_row)
+    for row in rows:
         security_name = value_or_dash(row, "證券名稱")
         security_code = value_or_dash(row, "證券代號")
         market = value_or_dash(row, "發行市場")
@@ -175,56 +289,59 @@ def build_events(
         bid_end = value_or_dash(row, "投標結束日")
         open_date = value_or_dash(row, "開標日期")
         allotment_date = value_or_dash(row, "撥券日期(上市、上櫃日期)")
-        conversion_price = row.get("轉換價", "").strip()
+        conversion_price = row.get("轉換價", "")
 
         is_convertible = "轉換公司債" in issue_type
 
         # Supplement with conversion_prices.json when API does not provide the value
         if is_convertible and not conversion_price and conversion_price_index:
-            bid_start_raw = row.get("投標開始日", "").strip()
-            bid_end_raw = row.get("投標結束日", "").strip()
+            bid_start_raw = row.get("投標開始日", "")
+            bid_end_raw = row.get("投標結束日", "")
             conversion_price = conversion_price_index.get(
                 (bid_start_raw, bid_end_raw), ""
             )
 
+        # Everything after the 事件 line is the same for all of a row's events.
+        conversion_line = (
+            f"轉換價(元)：{conversion_price}\n"
+            if is_convertible and conversion_price
+            else ""
+        )
+        details = (
+            f"證券名稱：{security_name}\n"
+            f"證券代號：{security_code}\n"
+            f"發行市場：{market}\n"
+            f"發行性質：{issue_type}\n"
+            f"{conversion_line}"
+            f"競拍方式：{auction_method}\n"
+            f"競拍數量(張)：{quantity}\n"
+            f"最低投標價格(元)：{min_price}\n"
+            f"最低每標單投標數量(張)：{min_bid_qty}\n"
+            f"最高投(得)標數量(張)：{max_bid_qty}\n"
+            f"主辦券商：{broker}\n"
+            f"投標開始日：{bid_start}\n"
+            f"投標結束日：{bid_end}\n"
+            f"開標日期：{open_date}\n"
+            f"撥券日期：{allotment_date}\n"
+            f"{SOURCE_LINE}"
+        )
+
+        escaped_details = ics_escape(details)
+        summary_prefix = f"[TWSE競拍] {security_name}({security_code})"
+        # UID source is code|name|event_type|date|market|issue_type.
+        uid_prefix = f"{security_code}|{security_name}|"
+        uid_suffix = f"|{market}|{issue_type}"
+
         for date_field, event_type in EVENT_DATE_FIELDS:
             event_date = parse_twse_date(row.get(date_field, ""))
             if event_date is None:
                 continue
 
-            summary = f"[TWSE競拍] {security_name}({security_code}) {event_type}"
-            desc_lines = [
-                f"事件：{event_type}",
-                f"證券名稱：{security_name}",
-                f"證券代號：{security_code}",
-                f"發行市場：{market}",
-                f"發行性質：{issue_type}",
-            ]
-            if is_convertible and conversion_price:
-                desc_lines.append(f"轉換價(元)：{conversion_price}")
-            desc_lines += [
-                f"競拍方式：{auction_method}",
-                f"競拍數量(張)：{quantity}",
-                f"最低投標價格(元)：{min_price}",
-                f"最低每標單投標數量(張)：{min_bid_qty}",
-                f"最高投(得)標數量(張)：{max_bid_qty}",
-                f"主辦券商：{broker}",
-                f"投標開始日：{bid_start}",
-                f"投標結束日：{bid_end}",
-                f"開標日期：{open_date}",
-                f"撥券日期：{allotment_date}",
-                f"資料來源：{SOURCE_PAGE}",
-            ]
-            description = "\n".join(desc_lines)
-            uid_source = "|".join(
-                [
-                    security_code,
-                    security_name,
-                    event_type,
-                    event_date.isoformat(),
-                    market,
-                    issue_type,
-                ]
+            summary = f"{summary_prefix} {event_type}"
+            event_line = f"事件：{event_type}\n"
+            description = f"{event_line}{details}"
+            uid_source = (
+                f"{uid_prefix}{event_type}|{event_date.isoformat()}{uid_suffix}"
             )
             events.append(
                 CalendarEvent(
@@ -232,53 +349,49 @@ def build_events(
                     summary=summary,
                     description=description,
                     uid=stable_uid(uid_source),
+                    escaped_description=ics_escape(event_line) + escaped_details,
                 )
             )
     return events
 
 
-def render_ics(events: Iterable[CalendarEvent]) -> str:
-    lines: list[str] = []
-
-    def add_line(raw: str) -> None:
-        for folded in fold_ical_line(raw):
-            lines.append(folded)
-
-    add_line("BEGIN:VCALENDAR")
-    add_line("VERSION:2.0")
-    add_line("PRODID:-//TWSE Auction Calendar//EN")
-    add_line("CALSCALE:GREGORIAN")
-    add_line("METHOD:PUBLISH")
-    add_line("X-WR-CALNAME:TWSE 競價拍賣公告")
-    add_line("X-WR-CALDESC:由 TWSE 競價拍賣公告自動產生")
-    add_line("X-WR-TIMEZONE:Asia/Taipei")
+def iter_ics_lines(events: Iterable[CalendarEvent]) -> Iterator[str]:
+    """Yield the unfolded content lines of the calendar, in output order."""
+    yield from CALENDAR_HEADER_LINES
 
     for event in sorted(events, key=lambda e: (e.event_date, e.summary, e.uid)):
-        add_line("BEGIN:VEVENT")
-        add_line(f"UID:{event.uid}")
-        add_line(f"DTSTAMP:{stable_dtstamp(event)}")
-        add_line(f"DTSTART;VALUE=DATE:{event.event_date.strftime('%Y%m%d')}")
-        add_line(
-            "DTEND;VALUE=DATE:"
-            f"{(event.event_date + timedelta(days=1)).strftime('%Y%m%d')}"
-        )
-        add_line(f"SUMMARY:{ics_escape(event.summary)}")
-        add_line(f"DESCRIPTION:{ics_escape(event.description)}")
-        add_line(f"URL:{SOURCE_PAGE}")
-        add_line("STATUS:CONFIRMED")
-        add_line("TRANSP:TRANSPARENT")
-        add_line("END:VEVENT")
-
-    add_line("END:VCALENDAR")
-    return "\r\n".join(lines) + "\r\n"
+        yield "BEGIN:VEVENT"
+        yield f"UID:{event.uid}"
+        yield f"DTSTAMP:{stable_dtstamp(event)}"
+        yield f"DTSTART;VALUE=DATE:{ics_date(event.event_date)}"
+        yield f"DTEND;VALUE=DATE:{ics_date(event.event_date + timedelta(days=1))}"
+        yield f"SUMMARY:{ics_escape(event.summary)}"
+        yield f"DESCRIPTION:{event.escaped_description}"
+        yield from EVENT_TRAILER_LINES
+
+    yield "END:VCALENDAR"
+
+
+def render_ics(events: Iterable[CalendarEvent]) -> bytes:
+    """Render the calendar as UTF-8 bytes, folding each line on octets."""
+    return b"".join(
+        folded + b"\r\n"
+        for raw in iter_ics_lines(events)
+        for folded in fold_ical_line(raw.encode("utf-8"))
+    )
 
 
 def resolve_year_range(start_year: int | None, end_year: int | None) -> tuple[int, int]:
-    year_info = fetch_json(f"{API_BASE}/auctionYear?response=json")
-    api_start = int(year_info["startYear"])
-    api_end = int(year_info["endYear"])
-    final_start = start_year if start_year is not None else api_start
-    final_end = end_year if end_year is not None else api_end
+    final_start, final_end = start_year, end_year
+    # Only ask TWSE for its year range when the CLI left a bound open.
+    if final_start is None or final_end is None:
+        year_info = fetch_json(
+            f"{API_BASE}/auctionYear?response=json", max_age=CURRENT_YEAR_CACHE_TTL
+        )
+        if final_start is None:
+            final_start = int(year_info["startYear"])
+        if final_end is None:
+            final_end = int(year_info["endYear"])
     if final_start > final_end:
         raise ValueError("start-year 不可大於 end-year")
     return final_start, final_end
@@ -286,9 +399,14 @@ def resolve_year_range(start_year: int | None, end_year: int | None) -> tuple[in
 
 def fetch_all_events(start_year: int, end_year: int) -> list[CalendarEvent]:
     conversion_price_index = load_conversion_price_index()
-    all_events: list[CalendarEvent] = []
-    for year in range(start_year, end_year + 1):
-        payload = fetch_json(f"{API_BASE}/auction?date={year}&response=json")
+    years = range(start_year, end_year + 1)
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        payloads = list(executor.map(fetch_year_payload, years))
+
+    # Auctions near New Year are listed under both years, with different
+    # columns, so collapse rows by (代號, 開標日期) and keep the later year's.
+    unique_rows: dict[tuple[str, str], dict[str, str]] = {}
+    for payload in payloads:
         status = str(payload.get("stat", "")).upper()
         if status != "OK":
             continue
@@ -296,7 +414,11 @@ def fetch_all_events(start_year: int, end_year: int) -> list[CalendarEvent]:
         rows = payload.get("data", [])
         if not isinstance(fields, list) or not isinstance(rows, list):
             continue
-        all_events.extend(build_events(fields, rows, conversion_price_index))
+        for raw_row in rows:
+            row = normalize_row(fields, raw_row)
+            unique_rows[(row.get("證券代號", ""), row.get("開標日期", ""))] = row
+
+    all_events = build_events(unique_rows.values(), conversion_price_index)
 
     # Deduplicate in case TWSE data overlaps between years.
     unique_by_uid: dict[str, CalendarEvent] = {}
@@ -318,11 +440,15 @@ def main() -> int:
 
     start_year, end_year = resolve_year_range(args.start_year, args.end_year)
     events = fetch_all_events(start_year, end_year)
-    ics_text = render_ics(events)
+    ics_bytes = render_ics(events)
 
     output_path = Path(args.output)
+    if output_path.exists() and output_path.read_bytes() == ics_bytes:
+        print(f"{output_path} 內容無變動，無需重寫（共 {len(events)} 個事件）")
+        return 0
+
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    output_path.write_text(ics_text, encoding="utf-8")
+    write_atomic(output_path, ics_bytes)
 
     print(
         f"完成：{output_path}，共 {len(events)} 個事件，資料年份 {start_year}~{end_year}",
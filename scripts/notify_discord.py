@@ -8,17 +8,54 @@ TWSE 競價拍賣 Discord 變動通知
 
 from __future__ import annotations
 
+import hashlib
 import json
 import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from pathlib import Path
-from urllib.error import HTTPError, URLError
-from urllib.request import Request, urlopen
+
+import requests
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup; stdlib json still works.
+    orjson = None
 
 API_BASE = "https://www.twse.com.tw/rwd/zh/announcement"
 SNAPSHOT_PATH = Path("calendar/snapshot.json")
 
+# Raw TWSE responses are cached here so generate_twse_auction_calendar.py and
+# this script share one download per run, and past years are not re-fetched.
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache" / "twse"
+CURRENT_YEAR_CACHE_TTL = 30 * 60
+PAST_YEAR_CACHE_TTL = 24 * 60 * 60
+
+# Years are fetched concurrently; keep this small to stay polite to TWSE.
+FETCH_WORKERS = 4
+
+# One pooled session so the per-year requests reuse the TLS connection.
+SESSION = requests.Session()
+SESSION.headers.update(
+    {
+        "User-Agent": (
+            "Mozilla/5.0 (compatible; twse-auction-calendar/1.0; "
+            "+https://www.twse.com.tw/)"
+        )
+    }
+)
+
+DISCORD_USERNAME = "TWSE 競價拍賣通知"
+DISCORD_AVATAR_URL = "https://www.twse.com.tw/favicon.ico"
+# Discord accepts at most 10 embeds per webhook message.
+MAX_EMBEDS = 10
+
+ADDED_TITLE, ADDED_COLOR = "🆕 新增拍賣", 0x22C55E
+CHANGED_TITLE, CHANGED_COLOR = "📝 資料更新", 0x3B82F6
+REMOVED_TITLE, REMOVED_COLOR = "❌ 已移除", 0xEF4444
+
 IGNORE_FIELDS = {"序號"}
 
 FIELD_LABELS = {
@@ -51,27 +88,51 @@ FIELD_LABELS = {
 }
 
 
+def loads_json(data: bytes):
+    """Decode UTF-8 JSON bytes, without an intermediate str when orjson exists."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode("utf-8"))
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Write via a sibling temp file so a killed run never leaves a partial file."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
 def row_key(row: dict) -> str:
     return f"{row.get('證券代號', '').strip()}-{row.get('開標日期', '').strip()}"
 
 
-def fetch_json(url: str, *, retries: int = 3, timeout: int = 20) -> dict:
-    request = Request(
-        url,
-        headers={
-            "User-Agent": (
-                "Mozilla/5.0 (compatible; twse-auction-calendar/1.0; "
-                "+https://www.twse.com.tw/)"
-            )
-        },
-    )
+def fetch_json(
+    url: str, *, retries: int = 3, timeout: int = 20, max_age: float = 0
+) -> dict:
+    """With max_age > 0, reuse a cached response younger than max_age seconds."""
+    cache_path = CACHE_DIR / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json"
+    if max_age > 0:
+        try:
+            if time.time() - cache_path.stat().st_mtime < max_age:
+                return loads_json(cache_path.read_bytes())
+        except (OSError, json.JSONDecodeError):
+            pass
+
     last_error: Exception | None = None
     for attempt in range(1, retries + 1):
         try:
-            with urlopen(request, timeout=timeout) as response:
-                body = response.read().decode("utf-8")
-            return json.loads(body)
-        except (HTTPError, URLError, TimeoutError, json.JSONDecodeError) as exc:
+            response = SESSION.get(url, timeout=timeout)
+            response.raise_for_status()
+            payload = loads_json(response.content)
+            # Never cache TWSE error/throttle replies, which come back as 200.
+            if max_age > 0 and str(payload.get("stat", "OK")).upper() == "OK":
+                CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                write_atomic(cache_path, response.content)
+            return payload
+        except (requests.RequestException, json.JSONDecodeError) as exc:
             last_error = exc
             if attempt == retries:
                 break
@@ -79,24 +140,41 @@ def fetch_json(url: str, *, retries: int = 3, timeout: int = 20) -> dict:
     raise RuntimeError(f"無法取得資料：{url}") from last_error
 
 
+def fetch_year_payload(year: int) -> dict:
+    """Fetch one year's auction list; past years are cached for longer."""
+    max_age = (
+        PAST_YEAR_CACHE_TTL if year < date.today().year else CURRENT_YEAR_CACHE_TTL
+    )
+    return fetch_json(f"{API_BASE}/auction?date={year}&response=json", max_age=max_age)
+
+
 def fetch_all_rows() -> list[dict]:
     """從 TWSE API 取得所有年份的原始資料列。"""
-    year_info = fetch_json(f"{API_BASE}/auctionYear?response=json")
+    year_info = fetch_json(
+        f"{API_BASE}/auctionYear?response=json", max_age=CURRENT_YEAR_CACHE_TTL
+    )
     start = int(year_info["startYear"])
     end = int(year_info["endYear"])
 
+    years = range(start, end + 1)
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        payloads = list(executor.map(fetch_year_payload, years))
+
     all_rows: list[dict] = []
-    for year in range(start, end + 1):
-        payload = fetch_json(f"{API_BASE}/auction?date={year}&response=json")
+    for payload in payloads:
         if str(payload.get("stat", "")).upper() != "OK":
             continue
         fields = payload.get("fields", [])
         for raw_row in payload.get("data", []):
-            row = {}
-            for idx, key in enumerate(fields):
-                row[key] = str(raw_row[idx]).strip() if idx < len(raw_row) else ""
+            # Columns missing from a short row default to "".
+            row = dict.fromkeys(fields, "")
+            row.update(zip(fields, (str(value).strip() for value in raw_row)))
             all_rows.append(row)
 
+    # Auctions near New Year are listed under both years; keep the later copy
+    # so the snapshot holds one row per row_key, matching the diff maps.
+    all_rows = list({row_key(r): r for r in all_rows}.values())
+
     print(f"已從 API 取得 {len(all_rows)} 筆拍賣資料（{start}~{end}）")
     return all_rows
 
@@ -105,7 +183,7 @@ def load_snapshot() -> dict[str, dict]:
     if not SNAPSHOT_PATH.exists():
         return {}
     try:
-        data = json.loads(SNAPSHOT_PATH.read_text(encoding="utf-8"))
+        data = loads_json(SNAPSHOT_PATH.read_bytes())
         return {row_key(r): r for r in data}
     except (json.JSONDecodeError, KeyError):
         return {}
@@ -113,16 +191,19 @@ def load_snapshot() -> dict[str, dict]:
 
 def save_snapshot(rows: list[dict]) -> None:
     SNAPSHOT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    SNAPSHOT_PATH.write_text(
-        json.dumps(rows, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
+    if orjson is not None:
+        # OPT_INDENT_2 output is byte-identical to the json.dumps call below.
+        data = orjson.dumps(rows, option=orjson.OPT_INDENT_2)
+    else:
+        data = json.dumps(rows, ensure_ascii=False, indent=2).encode("utf-8")
+    write_atomic(SNAPSHOT_PATH, data)
 
 
 def diff_data(
     old_map: dict[str, dict], new_map: dict[str, dict]
 ) -> tuple[list[dict], list[dict], list[tuple[dict, list[tuple[str, str, str]]]]]:
-    old_keys = set(old_map.keys())
-    new_keys = set(new_map.keys())
+    old_keys = old_map.keys()
+    new_keys = new_map.keys()
 
     added = [new_map[k] for k in sorted(new_keys - old_keys)]
     removed = [old_map[k] for k in sorted(old_keys - new_keys)]
@@ -131,7 +212,9 @@ def diff_data(
     for k in sorted(old_keys & new_keys):
         old_row, new_row = old_map[k], new_map[k]
         diffs = []
-        for field in sorted(set(list(old_row.keys()) + list(new_row.keys()))):
+        # TWSE column order, followed by any columns that were dropped.
+        fields = [*new_row, *(f for f in old_row if f not in new_row)]
+        for field in fields:
             if field in IGNORE_FIELDS:
                 continue
             old_val = old_row.get(field, "").strip()
@@ -145,6 +228,26 @@ def diff_data(
     return added, removed, changed
 
 
+def post_webhook(webhook_url: str, body: dict) -> requests.Response:
+    """POST one webhook message on the pooled session.
+
+    Batches are sent in order (the first one carries the summary), so on a
+    Discord 429 we wait out Retry-After and retry once instead of fanning out.
+    """
+    for attempt in range(2):
+        resp = SESSION.post(
+            webhook_url,
+            json=body,
+            headers={"User-Agent": "TWSE-Auction-Calendar/1.0"},
+            timeout=15,
+        )
+        if resp.status_code != 429 or attempt:
+            break
+        time.sleep(float(resp.headers.get("Retry-After", "1")))
+    resp.raise_for_status()
+    return resp
+
+
 def send_discord(
     webhook_url: str,
     added: list[dict],
@@ -171,8 +274,8 @@ def send_discord(
         if "轉換公司債" in issue_type and conversion_price:
             fields_list.append({"name": "轉換價格", "value": f"{conversion_price} 元", "inline": True})
         embeds.append({
-            "title": f"🆕 新增拍賣｜{name}（{code}）",
-            "color": 0x22C55E,
+            "title": f"{ADDED_TITLE}｜{name}（{code}）",
+            "color": ADDED_COLOR,
             "fields": fields_list,
         })
 
@@ -187,8 +290,8 @@ def send_discord(
                 "inline": True,
             })
         embeds.append({
-            "title": f"📝 資料更新｜{name}（{code}）",
-            "color": 0x3B82F6,
+            "title": f"{CHANGED_TITLE}｜{name}（{code}）",
+            "color": CHANGED_COLOR,
             "fields": fields_list,
         })
 
@@ -196,8 +299,8 @@ def send_discord(
         name = row.get("證券名稱", "").strip()
         code = row.get("證券代號", "").strip()
         embeds.append({
-            "title": f"❌ 已移除｜{name}（{code}）",
-            "color": 0xEF4444,
+            "title": f"{REMOVED_TITLE}｜{name}（{code}）",
+            "color": REMOVED_COLOR,
             "description": f"開標日期：{row.get('開標日期', '-')}",
         })
 
@@ -206,30 +309,19 @@ def send_discord(
 
     summary = f"新增 {len(added)} 筆 ∣ 更新 {len(changed)} 筆 ∣ 移除 {len(removed)} 筆"
 
-    MAX_EMBEDS = 10
     for i in range(0, len(embeds), MAX_EMBEDS):
         batch = embeds[i : i + MAX_EMBEDS]
         body = {
-            "username": "TWSE 競價拍賣通知",
-            "avatar_url": "https://www.twse.com.tw/favicon.ico",
+            "username": DISCORD_USERNAME,
+            "avatar_url": DISCORD_AVATAR_URL,
             "embeds": batch,
         }
         if i == 0:
             body["content"] = f"📊 **TWSE 競價拍賣資料變動**\n{summary}"
 
-        data = json.dumps(body).encode("utf-8")
-        req = Request(
-            webhook_url,
-            data=data,
-            headers={
-                "Content-Type": "application/json",
-                "User-Agent": "TWSE-Auction-Calendar/1.0",
-            },
-            method="POST",
-        )
         try:
-            with urlopen(req, timeout=15) as resp:
-                print(f"[Discord] 第 {i // MAX_EMBEDS + 1} 批通知已送出（{len(batch)} 則），HTTP {resp.status}")
+            resp = post_webhook(webhook_url, body)
+            print(f"[Discord] 第 {i // MAX_EMBEDS + 1} 批通知已送出（{len(batch)} 則），HTTP {resp.status_code}")
         except Exception as e:
             print(f"[Discord] 送出失敗: {e}")
 